@@ -4,16 +4,20 @@ from setuptools import setup
 with open('README.md') as f:
     readme = f.read()
 
+# tf.data options and prefetch_to_device need 1.13, the mixed precision
+# graph rewrite and loss scale optimizer of the VAE need 1.14
+tensorflow_version = '>=1.14.0'
+
 install_requires = ['numpy>=1.14.0']
 try:
     import tensorflow
 except ImportError:
-    install_requires.append('tensorflow>=1.4.0')
+    install_requires.append('tensorflow' + tensorflow_version)
 else:
     if tensorflow.test.is_built_with_cuda():
-        install_requires.append('tensorflow-gpu>=1.4.0')
+        install_requires.append('tensorflow-gpu' + tensorflow_version)
     else:
-        install_requires.append('tensorflow>=1.4.0')
+        install_requires.append('tensorflow' + tensorflow_version)
 
 setup(
     name='tfmodellib',
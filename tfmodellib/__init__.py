@@ -17,7 +17,7 @@ from tfmodellib.tfmodel import TFModel, TFModelConfig, graph_def, docsig
 from tfmodellib.linreg import LinReg, LinRegConfig, build_linreg_graph
 from tfmodellib.mlp import MLP, MLPConfig, build_mlp_graph
 from tfmodellib.autoencoder import AutoEncoder, AutoEncoderConfig, build_autoencoder_graph
-from tfmodellib.vae import VAE, VAEConfig, build_vae_graph, variational_loss
+from tfmodellib.vae import VAE, VAEConfig, build_vae_graph, build_vae_latent_layers, build_vae_log_sigma_latent_layers, build_vae_softplus_latent_layers, variational_loss
 from tfmodellib.cae2d import CAE2d, CAE2dConfig, build_cae_2d_graph, build_conv_encoder_2d_graph, build_conv_decoder_2d_graph, params_encoder_to_decoder
 from tfmodellib.convvae2d import ConvVAE2d, ConvVAE2dConfig
 from tfmodellib.convdenseae2d import ConvDenseAE2d, ConvDenseAE2dConfig
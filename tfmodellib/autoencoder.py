@@ -120,8 +120,9 @@ def build_autoencoder_graph(
     with tf.variable_scope(decoder_name):
 
         if decoder_size is None:
-            decoder_size = encoder_size
-            decoder_size.reverse()
+            # reversed copy (reversing in place would modify the caller's
+            # list, e.g., the encoder_size in the model config)
+            decoder_size = encoder_size[::-1]
 
         decoder_out = build_mlp_graph(
                 input_tensor=latent_layer,
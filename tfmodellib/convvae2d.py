@@ -62,14 +62,14 @@ class ConvVAE2d(TFModel):
         # define loss
         with tf.variable_scope('losses'):
 
-            # reconstruction losses for all samples, a vector of shape BATCH_SIZE x 1
+            # reconstruction loss, already averaged over the samples (scalar)
             with tf.variable_scope('reconstruction_loss'):
                 self.reconstruction_loss = self.config['reconstruction_loss'](self.y_target, self.y_output)
 
             # we keep beta as a placeholder, to allow adjusting it throughout the training.
             self.beta = tf.placeholder(dtype=tf.float32, shape=[], name='beta')
 
-            # variational (KL) losses for all samples, a vector of shape BATCH_SIZE x 1
+            # variational (KL) loss, already averaged over the samples (scalar)
             with tf.variable_scope('variational_loss'):
                 self.variational_loss = self.config['variational_loss'](
                         self.latent_mean, self.latent_sigma_sq,
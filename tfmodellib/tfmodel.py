@@ -21,6 +21,15 @@ import os
 import sys
 import inspect
 import importlib
+import io
+import functools
+import re
+
+try:
+    # faster JSON (de)serialization of configs, if available
+    import orjson
+except ImportError:
+    orjson = None
 
 
 def docsig(f):
@@ -45,33 +54,35 @@ def graph_def(fun):
     the entries of the TFModelConfig with matching keys to one of the function
     argument names will be passed to the function.
     """
+    # the names of the function's arguments (co_varnames also lists the local
+    # variables, which come after the arguments)
+    code = fun.__code__
+    num_args = code.co_argcount + getattr(code, 'co_kwonlyargcount', 0)
+    fun_argnames = frozenset(code.co_varnames[:num_args])
+
+    @functools.wraps(fun)
     def select_kwargs(*args, **kwargs):
-        fun_varnames = fun.__code__.co_varnames
         selected_kwargs = dict([
-                (key,val) for key,val in kwargs.items() if key in fun_varnames])
+                (key,kwargs[key]) for key in fun_argnames.intersection(kwargs)])
         return fun(*args, **selected_kwargs)
 
-    select_kwargs.__doc__ = fun.__doc__
-
     return select_kwargs
 
 
 
 def chunklist(values, length):
     """
-    Create a generator to split a list into chunks of equal length.
+    Split a list into chunks of equal length. Returns an array, of which each
+    row is one chunk. Values that do not fill a complete chunk are dropped.
 
-    >>> [l for l in chunklist(range(6),2)]
+    >>> chunklist(range(6),2).tolist()
     [[0, 1], [2, 3], [4, 5]]
-    >>> [l for l in chunklist(range(7),3)]
+    >>> chunklist(range(7),3).tolist()
     [[0, 1, 2], [3, 4, 5]]
     """
-    for i in range(0, len(values), length):
-        out = values[i:i+length]
-        if len(out) == length:
-            yield out
-        else:
-            return
+    values = np.asarray(values)
+    num_chunks = values.shape[0] // length
+    return values[:num_chunks*length].reshape((num_chunks, length) + values.shape[1:])
 
 
 def maybe_chunked(values, length, on_chunked, on_not_chunked, *args, **kwargs):
@@ -87,28 +98,23 @@ def maybe_chunked(values, length, on_chunked, on_not_chunked, *args, **kwargs):
     >>> maybe_chunked(range(5), 2, np.prod, np.sum)
     ([0, 6], True)
     """
-    was_chunked = None
     if length is None:
-        result = on_not_chunked(values, *args, **kwargs)
-        was_chunked = False
-    else:
-        try:
-            iter(on_chunked)
-        except TypeError:
-            result = []
-            for v in chunklist(values, length):
-                result.append(on_chunked(v, *args, **kwargs))
-            was_chunked = True
-        else:
-            result = []
-            for f in on_chunked:
-                sub_result = []
-                for v in chunklist(values, length):
-                    sub_result += f(v, *args, **kwargs)
-                result.append(sub_result)
-            was_chunked = True
+        return on_not_chunked(values, *args, **kwargs), False
+    return [on_chunked(v, *args, **kwargs) for v in chunklist(values, length)], True
+
 
-    return result, was_chunked
+def _has_non_finite_float(obj):
+    """
+    Returns True if OBJ is, or (in case of a dict, list or tuple) contains, a
+    NaN or infinite float.
+    """
+    if isinstance(obj, float):
+        return obj != obj or obj in (float('inf'), float('-inf'))
+    if isinstance(obj, dict):
+        return any(_has_non_finite_float(v) for v in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return any(_has_non_finite_float(v) for v in obj)
+    return False
 
 
 class TFModelConfigEncoder(json.JSONEncoder):
@@ -124,6 +130,9 @@ class TFModelConfigEncoder(json.JSONEncoder):
 
 class TFModelConfig(dict):
 
+    # buffer size for reading and writing config files
+    IO_BUFFER_SIZE = 64 * 1024
+
     def __init__(self, *args, **kwargs):
 
         self.defaults = {
@@ -138,7 +147,9 @@ class TFModelConfig(dict):
             'log_file':                 None,
             'batch_size':               32,
             'prefetch':                 None,
-            'shuffle_buffer':           None
+            'shuffle_buffer':           None,
+            'on_device_data':           False,
+            'prefetch_device':          None
         }
 
         self.update(self.defaults)
@@ -151,15 +162,32 @@ class TFModelConfig(dict):
 
     def save(self, fname):
         try:
-            with open(fname, 'w') as fp:
-                json.dump(self, fp, cls=TFModelConfigEncoder)
+            # orjson writes NaN and Infinity as null, the json module writes
+            # them as NaN and Infinity. Only use orjson if the config has no
+            # such values, so that the file is the same either way.
+            if orjson is not None and not _has_non_finite_float(self):
+                data = orjson.dumps(self, default=TFModelConfigEncoder().default)
+            else:
+                data = json.dumps(self, cls=TFModelConfigEncoder).encode('utf-8')
+            with io.open(fname, 'wb', buffering=TFModelConfig.IO_BUFFER_SIZE) as fp:
+                fp.write(data)
         except Exception as e:
             print(e)
 
     def load(self, fname):
         try:
-            with open(fname, 'r') as fp:
-                conf = json.load(fp)
+            with io.open(fname, 'rb', buffering=TFModelConfig.IO_BUFFER_SIZE) as fp:
+                data = fp.read()
+            conf = None
+            if orjson is not None:
+                try:
+                    conf = orjson.loads(data)
+                except ValueError:
+                    # orjson rejects NaN and Infinity, which the json module
+                    # writes and parses
+                    pass
+            if conf is None:
+                conf = json.loads(data.decode('utf-8'))
             for key,val in conf.items():
                 if isinstance(val, list) and len(val) > 0:
                     if val[0] == TFModelConfigEncoder.CALLABLE_TYPE:
@@ -187,17 +215,20 @@ class TFModel(object):
     def _init_from_config(self, config):
 
         self.config = config
-        self.summaries = dict()
+        # One Summary proto per mode, holding the values of all summaries of
+        # that mode, and a lookup of these values by key. update_summary
+        # changes the values in place, so that writing the summaries of a mode
+        # does not need to assemble a new proto.
+        self.summary_protos = dict([
+                (mode, tf.Summary()) for mode in self.valid_summary_modes()])
+        self.summary_values = dict()
 
         self.graph = tf.Graph()
-        self.sess = tf.Session(graph=self.graph)
+        self.sess = tf.Session(graph=self.graph, config=self.session_config())
 
         with self.graph.as_default():
-            self.init_datasets()
-            self.build_graph()
-
-        # add common elements to the graph
-        with self.graph.as_default():
+            # add common elements to the graph (before the model, so that
+            # build_graph can use the counters)
             with tf.variable_scope(self.config['scope_name']):
                 # record for number of epochs
                 self.global_step = tf.Variable(
@@ -209,11 +240,28 @@ class TFModel(object):
                         initial_value=0, trainable=False,
                         dtype=tf.int32, name='train_step')
                 self.increment_train_step_op = tf.assign_add(self.batch_step, 1)
+
+            self.init_datasets()
+            self.build_graph()
+
+            # The update ops (e.g. for batch norm statistics) are fixed once
+            # the graph is built. Group them and the step counter increment
+            # with the optimizer op, so that they run with every training
+            # step without a separate session run, also for models that did
+            # not add them as dependencies in build_graph.
+            self.update_ops = tuple(self.graph.get_collection(tf.GraphKeys.UPDATE_OPS))
+            if getattr(self, 'minimize_op', None) is not None:
+                self.minimize_op = tf.group(
+                        *((self.minimize_op, self.increment_train_step_op) + self.update_ops))
+
         
         self.init_logger()
         self.init_summaries()
         self.init_saver()
         self.init_variables()
+        # the step counter is incremented together with the training update,
+        # keep track of its value here instead of fetching it every step
+        self.train_step_count = self.sess.run(self.batch_step)
 
     def _init_from_checkpoint(self, config_json_fname):
         conf = TFModelConfig()
@@ -228,6 +276,13 @@ class TFModel(object):
             self.logger.log(logging.ERROR, '\n\nFailed to initialize from config file ({:s}).\n\n'.format(config_json_fname))
             raise e
 
+    def session_config(self):
+        """
+        Returns the tf.ConfigProto for the model's session, or None for the
+        default configuration. Override to configure the session of a model.
+        """
+        return None
+
     def build_graph(self):
         raise NotImplementedError('build_graph must be implemented by child class')
 
@@ -244,6 +299,12 @@ class TFModel(object):
         """
         Overload in child class to enable use of tf.Dataset instead of
         feed_dict logic. Simply return the training and validation datasets.
+        The batches of the resulting input pipelines are provided by
+        get_next_batch_op(); run_update_and_loss and run_loss should then
+        compute the loss on the training and validation batch, respectively.
+        If 'on_device_data' is True, the data is stored in device memory
+        instead, and the batches are sampled there (see
+        build_on_device_data).
         """
         return None, None, None, None
 
@@ -251,55 +312,181 @@ class TFModel(object):
 
         data = self.load_data()
 
-        if data[0] is not None:
+        if data[0] is not None and self.config['on_device_data']:
+
+            # keep the data in device memory and gather the mini-batches
+            # there, no input pipeline needed
+            self.trainset              = None
+            self.traindata_variables   = self.build_on_device_data(data[0], data[1], name='traindata')
+            self.next_train_batch      = self.gather_random_batch(*self.traindata_variables)
+            self.num_batches           = data[0].shape[0] // self.config['batch_size']
+            if data[2] is not None:
+                self.validdata_variables = self.build_on_device_data(data[2], data[3], name='validdata')
+                self.next_valid_batch  = self.gather_random_batch(*self.validdata_variables)
+            else:
+                self.next_valid_batch  = None
+
+        elif data[0] is not None:
 
+            # The input pipelines run on the host. With prefetch_to_device, the
+            # iterators have to be placed on the device that the batches are
+            # prefetched to (see iterator_device).
             with tf.device('/cpu:0'):
                 self.traindata_input   = tf.placeholder(dtype=tf.as_dtype(data[0].dtype), shape=data[0].shape)
                 self.traindata_target  = tf.placeholder(dtype=tf.as_dtype(data[1].dtype), shape=data[1].shape)
-                self.trainset          = tf.data.Dataset.from_tensor_slices((self.traindata_input, self.traindata_target))
-                self.trainset          = self.trainset.repeat()
-                if self.config['prefetch'] is not None:
-                    self.trainset      = self.trainset.prefetch(self.config['prefetch'])
-                if self.config['shuffle_buffer'] is not None:
-                    self.trainset      = self.trainset.shuffle(self.config['shuffle_buffer'])
-                self.trainset          = self.trainset.batch(self.config['batch_size'])
+                self.trainset          = self.build_dataset(self.traindata_input, self.traindata_target, data[0].shape[0])
+            with tf.device(self.iterator_device()):
                 self.trainset_iterator = self.trainset.make_initializable_iterator()
                 self.next_train_batch  = self.trainset_iterator.get_next()
-                self.num_batches       = data[0].shape[0] // self.config['batch_size']
-                self.sess.run(
-                        self.trainset_iterator.initializer,
-                        feed_dict={
-                                self.traindata_input:  data[0],
-                                self.traindata_target: data[1]})
-
-                if data[2] is not None:
+            self.num_batches           = data[0].shape[0] // self.config['batch_size']
+            self.sess.run(
+                    self.trainset_iterator.initializer,
+                    feed_dict={
+                            self.traindata_input:  data[0],
+                            self.traindata_target: data[1]})
+
+            if data[2] is not None:
+                with tf.device('/cpu:0'):
                     self.validdata_input   = tf.placeholder(dtype=tf.as_dtype(data[2].dtype), shape=data[2].shape)
                     self.validdata_target  = tf.placeholder(dtype=tf.as_dtype(data[3].dtype), shape=data[3].shape)
-                    self.validset          = tf.data.Dataset.from_tensor_slices((self.validdata_input, self.validdata_target))
-                    self.validset          = self.validset.repeat()
-                    if self.config['prefetch'] is not None:
-                        self.validset      = self.validset.prefetch(self.config['prefetch'])
-                    if self.config['shuffle_buffer'] is not None:
-                        self.validset      = self.validset.shuffle(self.config['shuffle_buffer'])
-                    self.validset          = self.validset.batch(self.config['batch_size'])
+                    self.validset          = self.build_dataset(self.validdata_input, self.validdata_target, data[2].shape[0])
+                with tf.device(self.iterator_device()):
                     self.validset_iterator = self.validset.make_initializable_iterator()
                     self.next_valid_batch  = self.validset_iterator.get_next()
-                    self.sess.run(
-                            self.validset_iterator.initializer,
-                            feed_dict={
-                                    self.validdata_input:  data[2],
-                                    self.validdata_target: data[3]})
-                else:
-                    self.next_valid_batch  = None
+                self.sess.run(
+                        self.validset_iterator.initializer,
+                        feed_dict={
+                                self.validdata_input:  data[2],
+                                self.validdata_target: data[3]})
+            else:
+                self.next_valid_batch  = None
 
         else:
             self.trainset              = None
             self.next_train_batch      = None
             self.next_valid_batch      = None
 
+    def build_on_device_data(self, inputs, targets, name):
+        """
+        Stores INPUTS and TARGETS in non-trainable variables, which are placed
+        on the default device (i.e., the GPU, if one is available), and
+        returns these variables. Mini-batches are then gathered from them with
+        gather_random_batch. The data is copied to the device only once,
+        instead of once per training step. This is suitable for datasets that
+        fit into device memory.
+
+        The variables are added to the LOCAL_VARIABLES collection, so they are
+        not stored in checkpoints, and they are initialized here, by feeding
+        the data (which keeps it out of the graph definition).
+        """
+        with tf.variable_scope(name):
+            inputs_placeholder = tf.placeholder(dtype=tf.as_dtype(inputs.dtype), shape=inputs.shape)
+            targets_placeholder = tf.placeholder(dtype=tf.as_dtype(targets.dtype), shape=targets.shape)
+            inputs_var = tf.Variable(
+                    inputs_placeholder, trainable=False,
+                    collections=[tf.GraphKeys.LOCAL_VARIABLES], name='inputs')
+            targets_var = tf.Variable(
+                    targets_placeholder, trainable=False,
+                    collections=[tf.GraphKeys.LOCAL_VARIABLES], name='targets')
+            self.sess.run(
+                    [inputs_var.initializer, targets_var.initializer],
+                    feed_dict={
+                            inputs_placeholder:  inputs,
+                            targets_placeholder: targets})
+
+            return inputs_var, targets_var
+
+    def gather_random_batch(self, inputs, targets):
+        """
+        Returns a mini-batch of 'batch_size' samples, drawn uniformly at random
+        (with replacement) from the INPUTS and TARGETS tensors.
+        """
+        inds = tf.random_uniform(
+                [self.config['batch_size']], 0, tf.shape(inputs)[0],
+                dtype=tf.int32, name='batch_inds')
+        return tf.gather(inputs, inds), tf.gather(targets, inds)
+
+    def build_dataset(self, inputs, targets, n_samples):
+        """
+        Creates the input pipeline for a pair of input and target tensors.
+        Samples are reshuffled in every pass over the data, and batches are
+        prefetched so that the pipeline runs concurrently with the training
+        steps. If 'shuffle_buffer' is None, the whole dataset is shuffled. If
+        'prefetch' is None, the prefetch buffer size is tuned at runtime.
+        The static optimizations returned by dataset_options() are applied to
+        the resulting dataset.
+
+        If prefetch_device() returns a device, batches are prefetched directly
+        into that device's memory, which hides the host to device copy behind
+        the computation of the previous training step.
+        """
+        shuffle_buffer = self.config['shuffle_buffer']
+        if shuffle_buffer is None:
+            shuffle_buffer = n_samples
+        dataset = tf.data.Dataset.from_tensor_slices((inputs, targets))
+        dataset = dataset.shuffle(shuffle_buffer, reshuffle_each_iteration=True)
+        dataset = dataset.repeat()
+        dataset = dataset.batch(self.config['batch_size'], drop_remainder=True)
+        dataset = dataset.with_options(self.dataset_options())
+        device = self.prefetch_device()
+        if device is not None:
+            # prefetch_to_device has to be the last transformation
+            dataset = dataset.apply(tf.data.experimental.prefetch_to_device(
+                    device, buffer_size=self.config['prefetch']))
+        else:
+            prefetch = self.config['prefetch']
+            if prefetch is None:
+                prefetch = tf.data.experimental.AUTOTUNE
+            dataset = dataset.prefetch(prefetch)
+        return dataset
+
+    def prefetch_device(self):
+        """
+        Returns the device onto which batches from the input pipelines are
+        prefetched (e.g., '/gpu:0'), or None to keep them in host memory. This
+        is the 'prefetch_device' config entry. The devices are not probed
+        here, because that would create all GPU devices of the process before
+        the model's session is configured.
+        """
+        return self.config['prefetch_device']
+
+    def iterator_device(self):
+        """
+        Returns the device for the iterators of the input pipelines: the
+        prefetch device, if there is one, otherwise the host.
+        """
+        device = self.prefetch_device()
+        if device is None:
+            return '/cpu:0'
+        return device
+
+    def dataset_options(self):
+        """
+        Returns the tf.data.Options for the input pipelines. Enables fusion of
+        adjacent dataset transformations, so that fewer iterator calls are
+        needed per batch. Override to change the options for a model.
+        """
+        options = tf.data.Options()
+        options.experimental_optimization.map_and_batch_fusion = True
+        options.experimental_optimization.map_fusion = True
+        options.experimental_optimization.shuffle_and_repeat_fusion = True
+        return options
+
     def get_next_batch_op(self):
         return self.next_train_batch, self.next_valid_batch
 
+    def get_new_train_batch_op(self):
+        """
+        Returns a new op for the next training mini-batch. Every evaluation of
+        next_train_batch yields only one mini-batch per run of the graph; use
+        this instead for additional mini-batches within one run (e.g., inside
+        a tf.while_loop).
+        """
+        if self.config['on_device_data']:
+            return self.gather_random_batch(*self.traindata_variables)
+        with tf.device(self.iterator_device()):
+            return self.trainset_iterator.get_next()
+
     def init_logger(self):
         self.logger = logging.Logger(
                 name=self.config['scope_name'], level=self.config['log_level'])
@@ -316,18 +503,19 @@ class TFModel(object):
 
     def add_summary(self, tag, key=None, mode='epoch'):
         if mode not in self.valid_summary_modes():
-            self.logger.log(logging.WARNING, 'Invalid summary mode {:s}, ignoring.'.format(which))
+            self.logger.log(logging.WARNING, 'Invalid summary mode {:s}, ignoring.'.format(mode))
         else:
             if key is None:
                 key = tag
-            self.summaries[key] = (float(), mode)
+            self.summary_values[key] = self.summary_protos[mode].value.add(
+                    tag=tag, simple_value=float())
 
     def update_summary(self, key, val):
         if self.summary_fwriter is not None:
             if key not in self.summary_values.keys():
                 self.logger.log(logging.WARNING, 'Invalid summary key "{:s}", skipping.'.format(key))
             else:
-                self.summary_values[key][0].simple_value = val
+                self.summary_values[key].simple_value = val
 
     def init_summaries(self):
         if self.config['summaries_root'] is not None:
@@ -336,7 +524,10 @@ class TFModel(object):
                 os.makedirs(summaries_root)
                 self.summaries_ind = 0
             else:
-                self.summaries_ind = np.max([0] + [int(n) for n in os.listdir(summaries_root)]) + 1
+                # continue numbering after the highest existing run, ignoring
+                # any entries that are not run directories
+                run_inds = [int(name) for name in os.listdir(summaries_root) if re.match(r'^[0-9]+$', name)]
+                self.summaries_ind = max(run_inds) + 1 if len(run_inds) > 0 else 0
             self.summary_fwriter = tf.summary.FileWriter(
                     logdir=os.path.join(summaries_root, str(self.summaries_ind)),
                     graph=self.sess.graph)
@@ -346,24 +537,29 @@ class TFModel(object):
             self.add_summary(tag='({:s}) epoch validation loss'.format(self.config['scope_name']), key='epoch_valid_loss', mode='epoch')
             self.add_summary(tag='({:s}) step training loss'.format(self.config['scope_name']), key='step_train_loss', mode='step')
             self.add_summary(tag='({:s}) step validation loss'.format(self.config['scope_name']), key='step_valid_loss', mode='step')
-
-            self.summary_values = dict([
-                    (tag, (tf.Summary.Value(tag=tag, simple_value=val[0]), val[1]))
-                    for tag, val in self.summaries.items()])
         else:
             self.summary_fwriter = None
 
-    def write_summary(self, which):
+    def write_summary(self, which, step=None, keys=None):
+        """
+        Writes all summaries of mode WHICH, or only those in KEYS, if given.
+        If STEP is None, the current epoch or training step (depending on
+        WHICH) is read from the graph.
+        """
         if which not in self.valid_summary_modes():
             self.logger.log(logging.WARNING, 'Invalid summary mode {:s}, ignoring.'.format(which))
         else:
             if self.summary_fwriter is not None:
-                value_list = [v for v,w in self.summary_values.values() if w == which]
-                if which == 'epoch':
-                    step = self.get_global_step()
-                elif which == 'step':
-                    step = self.sess.run(self.batch_step)
-                self.summary_fwriter.add_summary(tf.Summary(value=value_list), global_step=step)
+                if step is None:
+                    if which == 'epoch':
+                        step = self.get_global_step()
+                    elif which == 'step':
+                        step = self.sess.run(self.batch_step)
+                if keys is None:
+                    summary = self.summary_protos[which]
+                else:
+                    summary = tf.Summary(value=[self.summary_values[key] for key in keys])
+                self.summary_fwriter.add_summary(summary, global_step=step)
 
     def get_saver_variables(self):
         """ Override this to only save specific variables in checkpoints. """
@@ -393,51 +589,88 @@ class TFModel(object):
     def get_global_step(self):
         return self.sess.run(self.global_step)
 
+    def _mean_step_losses(self, num_batches, run_step):
+        """
+        Runs RUN_STEP(i) for the NUM_BATCHES steps of an epoch and returns the
+        mean of the step results. The array for the results is allocated from
+        the first step, so that it fits any shape and dtype of the losses.
+        """
+        if num_batches == 0:
+            raise ValueError('No complete mini-batch in the training data ' \
+                    '(the batch size is larger than the number of training samples).')
+        first = np.asarray(run_step(0))
+        losses = np.empty((num_batches,) + first.shape, dtype=first.dtype)
+        losses[0] = first
+        for i in range(1, num_batches):
+            losses[i] = run_step(i)
+        return losses.mean(axis=0)
+
     def train(self, train_inputs=None, train_targets=None, validation_inputs=None, validation_targets=None, batch_size=None, *args, **kwargs):
+        """
+        Runs one epoch of training. If the keyword argument VALIDATION_EVERY is
+        given (and not None), the validation loss is only computed in every
+        VALIDATION_EVERY-th epoch (and is NaN otherwise; no validation
+        summaries are written for the other epochs).
+        """
 
-        if self.trainset is None:
-
-            if train_inputs is None or train_targets is None:
-                raise ValueError('train_inputs and train_targets must not be None.')
-
-            n_samples = train_inputs.shape[0]
-            inds = np.random.permutation(range(n_samples))
-            if validation_inputs is not None:
-                # Training is done in mini-batches. We will draw an equal number of
-                # validation samples as we have training samples, and will then
-                # split both sets into mini-batches.
-                validation_inds = np.random.randint(0, validation_inputs.shape[0], n_samples)
-                # Stack the training and validation indices into a 2xN_SAMPLES
-                # matrix, which will later be divided into mini-batches of size
-                # 2xBATCH_SIZE.
-                inds = np.vstack((inds, validation_inds)).T
-            
-            result, was_chunked = maybe_chunked(
-                    inds, batch_size,
-                    self.train_step, self.train_step,
-                    train_inputs, train_targets,
-                    validation_inputs, validation_targets,
-                    *args, **kwargs)
+        validation_every = kwargs.pop('validation_every', None)
+        global_step = self.get_global_step()
+        validate = validation_every is None or global_step % validation_every == 0
 
-            if was_chunked:
-                if len(result) > 1:
-                    result = np.mean(result, axis=0)
-                elif len(result) == 1:
-                    result = result[0]
+        # enter the graph context once for all training steps of the epoch
+        with self.graph.as_default():
 
-        else:
+            if self.next_train_batch is not None:
+
+                # the input pipeline (or the on-device data) is part of the
+                # graph, no need to pass any data from Python
+                result = self._mean_step_losses(self.num_batches,
+                        lambda i: self.train_step(None, None, None, None, None, validate=validate, *args, **kwargs))
 
-            result = np.mean([
-                self.train_step(None, None, None, None, None, *args, **kwargs)
-                for _ in range(self.num_batches)],
-                axis=0)
+            else:
+
+                # fallback for models that do not provide a tf.data pipeline
+                # through load_data()
+                if train_inputs is None or train_targets is None:
+                    raise ValueError('train_inputs and train_targets must not be None.')
+
+                n_samples = train_inputs.shape[0]
+                if batch_size is None:
+                    batch_size = n_samples
+
+                num_batches = n_samples // batch_size
+                num_used = num_batches * batch_size
+
+                # Shuffle the training samples with a single gather per epoch
+                # (samples that do not fill a complete mini-batch are
+                # dropped). The mini-batches are then contiguous slices of the
+                # shuffled arrays, which requires no further copies.
+                inds = np.random.permutation(n_samples)[:num_used].astype(np.int32, copy=False)
+                train_inputs = train_inputs.take(inds, axis=0)
+                train_targets = train_targets.take(inds, axis=0)
+
+                if not validate:
+                    validation_inputs = validation_targets = None
+
+                if validation_inputs is not None:
+                    # We will draw an equal number of validation samples as we
+                    # have training samples, gathered in the same way.
+                    validation_inds = np.random.randint(
+                            0, validation_inputs.shape[0], num_used, dtype=np.int32)
+                    validation_inputs = validation_inputs.take(validation_inds, axis=0)
+                    validation_targets = validation_targets.take(validation_inds, axis=0)
+
+                result = self._mean_step_losses(num_batches,
+                        lambda i: self.train_step(
+                            slice(i*batch_size, (i+1)*batch_size),
+                            train_inputs, train_targets,
+                            validation_inputs, validation_targets,
+                            validate=validate, *args, **kwargs))
 
         self.on_epoch_done()
 
         training_loss, validation_loss = result
 
-        global_step = self.get_global_step()
-
         if self.config['saver_interval'] is not None \
                 and global_step % self.config['saver_interval'] == 0:
             self.save()
@@ -445,16 +678,24 @@ class TFModel(object):
         if self.config['epoch_summaries_interval'] is not None \
                 and global_step % self.config['epoch_summaries_interval'] == 0:
             self.update_summary('epoch_train_loss', training_loss)
-            self.update_summary('epoch_valid_loss', validation_loss)
-            self.write_summary(which='epoch')
-
-        # Write a bit of information to the log
-        log_message = '{:9d}'.format(global_step)
-        log_message += '\ttrain loss: {:4.05f}'.format(training_loss)
-        log_message += '\tvalidate: {:4.05f}'.format(validation_loss)
-        self.logger.log(logging.INFO, log_message)
+            if validate:
+                self.update_summary('epoch_valid_loss', validation_loss)
+                self.write_summary(which='epoch', step=global_step)
+            else:
+                self.write_summary(which='epoch', step=global_step, keys=['epoch_train_loss'])
+
+        # Write a bit of information to the log (the message is only formatted
+        # if INFO messages are enabled)
+        if validate:
+            self.logger.log(logging.INFO,
+                    '%9d\ttrain loss: %4.5f\tvalidate: %4.5f',
+                    global_step, training_loss, validation_loss)
+        else:
+            self.logger.log(logging.INFO,
+                    '%9d\ttrain loss: %4.5f',
+                    global_step, training_loss)
 
-        global_step = self.sess.run(self.increment_global_step_op)
+        self.sess.run(self.increment_global_step_op)
 
         return training_loss, validation_loss
 
@@ -465,54 +706,56 @@ class TFModel(object):
         """
         pass
 
-    def train_step(self, inds, train_inputs, train_targets, validation_inputs, validation_targets, *args, **kwargs):
+    def train_step(self, batch, train_inputs, train_targets, validation_inputs, validation_targets, *args, **kwargs):
         """
+        Runs one training step. The validation loss is only computed if the
+        keyword argument VALIDATE is True (the default), and is NaN otherwise.
         """
 
-        if inds is not None:
-            # INDS specifies the indices of the samples to use as a mini-batch.
+        validate = kwargs.pop('validate', True)
 
-            if validation_inputs is not None:
-                training_inds, validation_inds = inds.T
-            else:
-                training_inds = inds
- 
-            with self.graph.as_default():
-                with tf.control_dependencies(self.graph.get_collection(tf.GraphKeys.UPDATE_OPS)):
-                    training_loss = self.run_update_and_loss(
-                            batch_inputs=train_inputs[training_inds],
-                            batch_targets=train_targets[training_inds],
-                            *args, **kwargs)
+        if batch is not None:
+            # BATCH is a slice, which selects the samples of the mini-batch
+            # from the (already shuffled) training and validation data.
+
+            training_loss = self.run_update_and_loss(
+                    batch_inputs=train_inputs[batch],
+                    batch_targets=train_targets[batch],
+                    *args, **kwargs)
 
             validation_loss = np.nan
-            if validation_inputs is not None:
+            if validate and validation_inputs is not None:
 
                 validation_loss = self.run_loss(
-                        batch_inputs=validation_inputs[validation_inds],
-                        batch_targets=validation_targets[validation_inds],
+                        batch_inputs=validation_inputs[batch],
+                        batch_targets=validation_targets[batch],
                         *args, **kwargs)
 
         else:
-            with self.graph.as_default():
-                with tf.control_dependencies(self.graph.get_collection(tf.GraphKeys.UPDATE_OPS)):
-                    training_loss = self.run_update_and_loss(*args, **kwargs)
+            # Mini-batches are taken from the input pipelines (see
+            # init_datasets). The validation batches are already in the graph
+            # as well, so there is nothing to index or feed from Python.
+            training_loss = self.run_update_and_loss(*args, **kwargs)
             validation_loss = np.nan
-            if validation_inputs is not None:
+            if validate and self.next_valid_batch is not None:
                 validation_loss = self.run_loss(*args, **kwargs)
 
         self.on_train_step_done()
 
-        step_count = self.sess.run(self.batch_step)
+        # the counter in the graph was incremented by the training update
+        step_count = self.train_step_count
+        self.train_step_count += 1
 
         if self.summary_fwriter is not None \
                 and self.config['step_summaries_interval'] is not None \
                 and step_count % self.config['step_summaries_interval'] == 0:
 
             self.update_summary('step_train_loss', training_loss)
-            self.update_summary('step_valid_loss', validation_loss)
-            self.write_summary(which='step')
-
-        step_count = self.sess.run(self.increment_train_step_op)
+            if validate:
+                self.update_summary('step_valid_loss', validation_loss)
+                self.write_summary(which='step', step=step_count)
+            else:
+                self.write_summary(which='step', step=step_count, keys=['step_train_loss'])
 
         return training_loss, validation_loss
 
@@ -524,18 +767,39 @@ class TFModel(object):
         pass
 
     def infer(self, inputs, batch_size=None, *args, **kwargs):
-        result, was_chunked = maybe_chunked(
-                list(range(inputs.shape[0])), batch_size,
-                self.infer_step, self.infer_step,
-                inputs, *args, **kwargs)
-        if was_chunked:
-            if len(result) > 1:
-                result = np.vstack(result)
-            else:
-                result = result[0]
-        return result
+        """
+        Computes the outputs for INPUTS, in chunks of BATCH_SIZE samples (or
+        all at once, if BATCH_SIZE is None), and returns them as a single
+        array. If the keyword argument OUT is given (and not None), the
+        outputs are written into this array (which is returned), instead of
+        allocating a new one.
+        """
+        out = kwargs.pop('out', None)
+        with self.graph.as_default():
+            if batch_size is None:
+                if out is None:
+                    return self.infer_step(slice(None), inputs, *args, **kwargs)
+                out[...] = self.infer_step(slice(None), inputs, *args, **kwargs)
+                return out
+
+            # The output of the first chunk determines the shape and dtype of
+            # the output buffer for all samples (unless given by OUT). Each
+            # chunk (including an incomplete last one) is then written into
+            # its slice.
+            n_samples = inputs.shape[0]
+            for start in range(0, n_samples, batch_size):
+                inds = slice(start, start+batch_size)
+                output = self.infer_step(inds, inputs, *args, **kwargs)
+                if out is None:
+                    out = np.empty((n_samples,) + output.shape[1:], dtype=output.dtype)
+                out[inds] = output
+            return out
 
     def infer_step(self, inds, inputs, *args, **kwargs):
+        """
+        Computes the output for the samples in INPUTS selected by INDS (a
+        slice, so that no copy of the inputs is made).
+        """
         return self.run_output(inputs[inds], *args, **kwargs)
 
     def save(self):
@@ -558,3 +822,4 @@ class TFModel(object):
         self.logger.log(logging.DEBUG,
                 'restoring from {:s}\n'.format(save_path))
         self.saver.restore(sess=self.sess, save_path=save_path)
+        self.train_step_count = self.sess.run(self.batch_step)
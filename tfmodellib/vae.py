@@ -16,6 +16,34 @@
 from tfmodellib import TFModel, TFModelConfig, graph_def, docsig, MLP, build_mlp_graph
 
 import tensorflow as tf
+from tensorflow.core.protobuf import rewriter_config_pb2
+import numpy as np
+import contextlib
+
+
+@contextlib.contextmanager
+def maybe_xla_jit_scope(use_xla_jit):
+    """
+    A context in which the created ops are compiled with XLA if USE_XLA_JIT is
+    True. If USE_XLA_JIT is False, the context has no effect.
+    """
+    if use_xla_jit:
+        with tf.xla.experimental.jit_scope(compile_ops=True):
+            yield
+    else:
+        yield
+
+
+def build_vae_latent_heads(input_tensor, units, sigma_name):
+    """
+    Maps INPUT_TENSOR onto the latent mean and the (not yet activated)
+    parameter of the noise distribution, each with UNITS units. Both are
+    computed by a single dense layer with 2*UNITS units, whose output is split
+    in two, which needs one matmul instead of two.
+    """
+    latent_heads = tf.layers.dense(input_tensor, units=2*units, activation=None, name='latent_mean_and_'+sigma_name)
+    latent_mean, latent_sigma = tf.split(latent_heads, 2, axis=-1)
+    return tf.identity(latent_mean, name='latent_mean'), tf.identity(latent_sigma, name=sigma_name)
 
 
 def build_vae_latent_layers(input_tensor, units):
@@ -24,8 +52,6 @@ def build_vae_latent_layers(input_tensor, units):
     # define latent mean, sigma_sq, randn
     #
 
-    latent_mean = tf.layers.dense(input_tensor, units=units, activation=None, name='latent_mean')
-
     # For the computation of the loss, we need:
     #     sigma**2
     #     log(sigma**2)
@@ -34,22 +60,65 @@ def build_vae_latent_layers(input_tensor, units):
     # computing exp(log(sigma**2)) to obtain sigma**2 (note that
     # float32(exp(88.73))=inf). To avoid this, we instead map the encoder
     # output onto sigma directly, and compute sigma**2 and log(sigma**2)
-    # from there (while adding a small constant to sigma**2 before
-    # computing the log, in case sigma is exactly 0.0).
+    # from there, as log(sigma**2) = 2*log(|sigma|) (while adding a small
+    # constant to |sigma| before computing the log, in case sigma is exactly
+    # 0.0).
     # Furthermore, we use linear activation, which can produce negative
     # values for sigma. We compensate for this by multiplying the random
     # noise with the absolute value of sigma, instead of relying on
     # something like ReLU activation, which could kill off the units.
 
-    latent_sigma = tf.layers.dense(input_tensor, units=units, activation=None, name='latent_sigma_before_abs')
-    latent_sigma_sq = tf.square(latent_sigma, name='latent_sigma_sq')
-    small_constant_for_numerical_stability = tf.constant(1e-20, dtype=tf.float32, name='small_constant_for_numerical_stability')
-    latent_log_sigma_sq = tf.log(latent_sigma_sq + small_constant_for_numerical_stability, name='latent_log_sigma_sq')
+    latent_mean, latent_sigma = build_vae_latent_heads(input_tensor, units, 'latent_sigma_before_abs')
     latent_sigma = tf.abs(latent_sigma, name='latent_sigma')
+    small_constant_for_numerical_stability = tf.constant(1e-10, dtype=tf.float32, name='small_constant_for_numerical_stability')
+    latent_log_sigma_sq = tf.multiply(2.0, tf.log(latent_sigma + small_constant_for_numerical_stability), name='latent_log_sigma_sq')
+    latent_sigma_sq = tf.multiply(latent_sigma, latent_sigma, name='latent_sigma_sq')
     latent_randn = tf.random_normal(shape=tf.shape(latent_mean), dtype=tf.float32, name='latent_randn')
 
     # define latent layer
-    latent_layer = tf.add(latent_mean, tf.multiply(latent_sigma, latent_randn), name='latent')
+    latent_layer = tf.add(latent_mean, latent_sigma * latent_randn, name='latent')
+
+    return latent_layer, latent_mean, latent_sigma, latent_sigma_sq, latent_log_sigma_sq
+
+
+def build_vae_log_sigma_latent_layers(input_tensor, units):
+    """
+    Alternative to build_vae_latent_layers, which maps the encoder output onto
+    log(sigma) and computes sigma and sigma**2 with exp. To avoid the overflow
+    of exp, log(sigma) is clipped to [-20, 20]. Needs no small constant for
+    numerical stability, and no abs, square or log.
+    """
+
+    latent_mean, latent_log_sigma = build_vae_latent_heads(input_tensor, units, 'latent_log_sigma_before_clip')
+    latent_log_sigma = tf.clip_by_value(latent_log_sigma, -20.0, 20.0, name='latent_log_sigma')
+    latent_log_sigma_sq = tf.multiply(2.0, latent_log_sigma, name='latent_log_sigma_sq')
+    latent_sigma = tf.exp(latent_log_sigma, name='latent_sigma')
+    latent_sigma_sq = tf.exp(latent_log_sigma_sq, name='latent_sigma_sq')
+    latent_randn = tf.random_normal(shape=tf.shape(latent_mean), dtype=tf.float32, name='latent_randn')
+
+    # define latent layer
+    latent_layer = tf.add(latent_mean, latent_sigma * latent_randn, name='latent')
+
+    return latent_layer, latent_mean, latent_sigma, latent_sigma_sq, latent_log_sigma_sq
+
+
+def build_vae_softplus_latent_layers(input_tensor, units):
+    """
+    Alternative to build_vae_latent_layers, which computes sigma from the
+    encoder output with softplus, plus a small constant, such that sigma is
+    strictly positive and log(sigma**2) = 2*log(sigma) cannot underflow to
+    -inf. Suitable for reduced precision (float16, bfloat16), e.g., with
+    use_mixed_precision.
+    """
+
+    latent_mean, latent_sigma = build_vae_latent_heads(input_tensor, units, 'latent_sigma_before_softplus')
+    latent_sigma = tf.add(tf.nn.softplus(latent_sigma), 1e-6, name='latent_sigma')
+    latent_log_sigma_sq = tf.multiply(2.0, tf.log(latent_sigma), name='latent_log_sigma_sq')
+    latent_sigma_sq = tf.multiply(latent_sigma, latent_sigma, name='latent_sigma_sq')
+    latent_randn = tf.random_normal(shape=tf.shape(latent_mean), dtype=tf.float32, name='latent_randn')
+
+    # define latent layer
+    latent_layer = tf.add(latent_mean, latent_sigma * latent_randn, name='latent')
 
     return latent_layer, latent_mean, latent_sigma, latent_sigma_sq, latent_log_sigma_sq
 
@@ -60,8 +129,8 @@ def build_vae_graph(
         input_tensor, latent_size, encoder_size, decoder_size=None,
         hidden_activation=tf.nn.relu, output_activation=None,
         use_dropout=False, use_bn=False, bn_is_training=False,
-        latent_layer_build_fun=build_vae_latent_layers,
-        encoder_name='encoder', latent_name='latent_layers', decoder_name='decoder'):
+        latent_layer_build_fun=build_vae_latent_layers, use_xla_jit=False,
+        use_resource=True, encoder_name='encoder', latent_name='latent_layers', decoder_name='decoder'):
     """
     Defines a VAE graph, with `len(encoder_size)+1+len(decoder_size)` dense
     layers:
@@ -108,6 +177,23 @@ def build_vae_graph(
         Indicates whether or not to add a batch norm layer after each hidden
         layer (default: False).
 
+    latent_layer_build_fun : function (optional)
+        Function that builds the latent layer from the encoder output and the
+        number of latent units (default: build_vae_latent_layers, see also
+        build_vae_log_sigma_latent_layers and
+        build_vae_softplus_latent_layers).
+
+    use_xla_jit : bool (optional)
+        Indicates whether or not to compile the (elementwise) ops of the
+        latent layer with XLA, which fuses them into fewer kernels (default:
+        False).
+
+    use_resource : bool (optional)
+        Indicates whether or not to create resource variables, instead of
+        reference variables, for the layers of the VAE (default: True).
+        Resource variables can be clustered by XLA and rewritten for mixed
+        precision.
+
     Returns
     -------
     reconstruction : Tensor
@@ -128,7 +214,7 @@ def build_vae_graph(
     """
 
     # define encoder
-    with tf.variable_scope(encoder_name):
+    with tf.variable_scope(encoder_name, use_resource=use_resource):
         encoder_out = build_mlp_graph(
                 input_tensor=input_tensor,
                 out_size=encoder_size[-1],
@@ -142,19 +228,20 @@ def build_vae_graph(
         if use_bn:
             encoder_out = tf.layers.batch_normalization(encoder_out, training=bn_is_training, name='batchnorm_encoder_out')
 
-    with tf.variable_scope(latent_name):
+    with tf.variable_scope(latent_name, use_resource=use_resource), maybe_xla_jit_scope(use_xla_jit):
         latent_layer, \
         latent_mean, \
         latent_sigma, \
         latent_sigma_sq, \
-        latent_log_sigma_sq = build_vae_latent_layers(encoder_out, latent_size)
+        latent_log_sigma_sq = latent_layer_build_fun(encoder_out, latent_size)
 
     # define decoder
-    with tf.variable_scope(decoder_name):
+    with tf.variable_scope(decoder_name, use_resource=use_resource):
 
         if decoder_size is None:
-            decoder_size = encoder_size
-            decoder_size.reverse()
+            # reversed copy (reversing in place would modify the caller's
+            # list, e.g., the encoder_size in the model config)
+            decoder_size = encoder_size[::-1]
 
         decoder_out = build_mlp_graph(
                 input_tensor=latent_layer,
@@ -177,11 +264,15 @@ def build_vae_graph(
 
 
 def variational_loss(latent_mean, latent_sigma_sq, latent_log_sigma_sq):
-    return tf.reduce_mean(0.5 * tf.reduce_sum(
-            - 1.0
-            - latent_log_sigma_sq
-            + tf.square(latent_mean)
-            + latent_sigma_sq, axis=-1))
+    # sum_i(-1 - log(sigma_i**2) + mean_i**2 + sigma_i**2), with each term
+    # reduced separately, so that every reduction can be fused with its
+    # (at most one) elementwise op, instead of materializing their sum
+    latent_size = tf.cast(tf.shape(latent_mean)[-1], dtype=tf.float32)
+    return tf.reduce_mean(0.5 * (
+            tf.reduce_sum(tf.square(latent_mean), axis=-1)
+            + tf.reduce_sum(latent_sigma_sq, axis=-1)
+            - tf.reduce_sum(latent_log_sigma_sq, axis=-1)
+            - latent_size))
 
 
 class VAEConfig(TFModelConfig):
@@ -199,93 +290,298 @@ class VAEConfig(TFModelConfig):
                 use_bn=False,
                 reconstruction_loss=tf.losses.mean_squared_error,
                 variational_loss=variational_loss,
-                build_vae_latent_layers_fun=build_vae_latent_layers)
+                build_vae_latent_layers_fun=build_vae_latent_layers,
+                use_xla_jit=False,
+                use_mixed_precision=False,
+                use_resource=True,
+                train_steps_per_run=None,
+                static_batch_size=None,
+                latent_analysis_dims=None)
         super(VAEConfig, self).init()
 
 class VAE(MLP):
 
     def build_graph(self):
 
+        # With a static batch size, all shapes in the graph are known, and the
+        # whole graph (including the optimizer) is compiled with XLA.
+        # Inputs then always have to be fed in batches of that size (infer_step
+        # pads smaller batches).
+        if self.config['static_batch_size'] is not None \
+                and self.next_train_batch is not None \
+                and self.config['static_batch_size'] != self.config['batch_size']:
+            raise ValueError('static_batch_size must be equal to batch_size, if the data is provided by load_data.')
+        input_shape = [self.config['static_batch_size'], self.config['in_size']]
+        self.compile_graph = compile_graph = self.config['static_batch_size'] is not None
+
         with tf.variable_scope('placeholders'):
             # define input and target placeholder
-            self.x_input = tf.placeholder(dtype=tf.float32, shape=[None, self.config['in_size']], name='x_input')
-            self.y_target = tf.placeholder(dtype=tf.float32, shape=[None, self.config['in_size']], name='y_target')
-
-            # define learning rate
-            self.learning_rate = tf.placeholder(dtype=tf.float32, shape=[], name='learning_rate')
+            if self.next_train_batch is None:
+                self.x_input = tf.placeholder(dtype=tf.float32, shape=input_shape, name='x_input')
+                self.y_target = tf.placeholder(dtype=tf.float32, shape=input_shape, name='y_target')
+            else:
+                # Take the training batches from the input pipeline (see
+                # load_data). Feeding the placeholders overrides the pipeline,
+                # e.g., for validation and inference.
+                self.x_input = tf.placeholder_with_default(tf.cast(self.next_train_batch[0], tf.float32), shape=input_shape, name='x_input')
+                self.y_target = tf.placeholder_with_default(tf.cast(self.next_train_batch[1], tf.float32), shape=input_shape, name='y_target')
+
+            # define learning rate (a variable, which is only assigned when
+            # the value changes, see set_hyperparameters)
+            self.learning_rate = tf.Variable(initial_value=0.0, trainable=False, dtype=tf.float32, name='learning_rate')
+            self.learning_rate_value = tf.placeholder(dtype=tf.float32, shape=[], name='learning_rate_value')
+            self.assign_learning_rate_op = tf.assign(self.learning_rate, self.learning_rate_value)
 
             # training flag for batchnorm
             self.bn_is_training = tf.placeholder(dtype=tf.bool, shape=[], name='bn_is_training')
 
         # define the base graph
-        with tf.variable_scope('vae_graph'):
+        with tf.variable_scope('vae_graph') as self.vae_scope, maybe_xla_jit_scope(compile_graph):
             self.y_output, \
             self.latent_layer, \
             self.latent_mean, \
             self.latent_sigma, \
             self.latent_sigma_sq, \
-            self.latent_log_sigma_sq = build_vae_graph(input_tensor=self.x_input, bn_is_training=self.bn_is_training, **self.config)
-
-        # define loss
-        with tf.variable_scope('losses'):
-
-            # reconstruction losses for all samples, a vector of shape BATCH_SIZE x 1
-            with tf.variable_scope('reconstruction_losses'):
-                self.reconstruction_losses = self.config['reconstruction_loss'](self.y_target, self.y_output)
-
-            # we keep beta as a placeholder, to allow adjusting it throughout the training.
-            self.beta = tf.placeholder(dtype=tf.float32, shape=[], name='beta')
-
-            # variational (KL) losses for all samples, a vector of shape BATCH_SIZE x 1
-            with tf.variable_scope('variational_losses'):
-                self.variational_losses = self.config['variational_loss'](
-                        self.latent_mean, self.latent_sigma_sq,
-                        self.latent_log_sigma_sq)
-
-            # combined loss, scalar
-            with tf.variable_scope('loss'):
-                self.loss = tf.add(self.reconstruction_losses, self.beta * self.variational_losses)
+            self.latent_log_sigma_sq = self.build_vae(self.x_input, self.bn_is_training)
+
+        # define loss (the losses are mostly elementwise ops and reductions,
+        # which XLA can fuse, if enabled)
+        with tf.variable_scope('losses'), maybe_xla_jit_scope(self.config['use_xla_jit'] or compile_graph):
+
+            # we keep beta as a variable, to allow adjusting it throughout the
+            # training (see set_hyperparameters).
+            self.beta = tf.Variable(initial_value=0.0, trainable=False, dtype=tf.float32, name='beta')
+            self.beta_value = tf.placeholder(dtype=tf.float32, shape=[], name='beta_value')
+            self.assign_beta_op = tf.assign(self.beta, self.beta_value)
+
+            self.reconstruction_losses, \
+            self.variational_losses, \
+            self.loss = self.build_losses(
+                    self.y_target, self.y_output, self.latent_mean,
+                    self.latent_sigma_sq, self.latent_log_sigma_sq)
+
+        # With input pipelines (or on-device data), the validation loss is
+        # computed in the graph as well, on the validation batches, so that no
+        # data has to be passed through Python (batch norm in inference mode,
+        # which adds no update ops).
+        if self.next_valid_batch is not None:
+            with tf.variable_scope(self.vae_scope, reuse=True), maybe_xla_jit_scope(compile_graph):
+                valid_outputs, \
+                _, \
+                valid_latent_mean, \
+                _, \
+                valid_latent_sigma_sq, \
+                valid_latent_log_sigma_sq = self.build_vae(tf.cast(self.next_valid_batch[0], tf.float32), False)
+
+            with tf.variable_scope('validation_losses'), maybe_xla_jit_scope(self.config['use_xla_jit'] or compile_graph):
+                _, _, self.validation_loss = self.build_losses(
+                        tf.cast(self.next_valid_batch[1], tf.float32), valid_outputs,
+                        valid_latent_mean, valid_latent_sigma_sq, valid_latent_log_sigma_sq)
+        else:
+            self.validation_loss = None
 
         # define optimizer
         with tf.control_dependencies(self.graph.get_collection(tf.GraphKeys.UPDATE_OPS)):
-            with tf.variable_scope('optimization'):
+            with tf.variable_scope('optimization'), maybe_xla_jit_scope(compile_graph):
                 self.optimizer = self.config['optimizer'](learning_rate=self.learning_rate)
+                if self.config['use_mixed_precision']:
+                    # dynamic loss scaling for the float16 gradients (the
+                    # graph rewrite itself is enabled in session_config)
+                    self.optimizer = tf.train.experimental.MixedPrecisionLossScaleOptimizer(self.optimizer, 'dynamic')
                 self.minimize_op = self.optimizer.minimize(self.loss)
 
-    def run_update_and_loss(self, batch_inputs, batch_targets, learning_rate, beta):
-        loss, _ = self.sess.run([self.loss, self.minimize_op], feed_dict={
-                self.x_input: batch_inputs,
-                self.y_target: batch_targets,
-                self.learning_rate: learning_rate,
-                self.beta: beta,
-                self.bn_is_training: True})
+        # Optionally, summarize the latent code in the graph: the mean sigma
+        # of each latent dimension, the latent_analysis_dims dimensions with
+        # the lowest mean sigma, and the latent means of these dimensions.
+        # Fetching these requires no transfer of the full latent tensors.
+        if self.config['latent_analysis_dims'] is not None:
+            with tf.variable_scope('latent_analysis'):
+                self.latent_sigma_mean = tf.reduce_mean(self.latent_sigma, axis=0, name='latent_sigma_mean')
+                _, self.latent_analysis_dims = tf.nn.top_k(
+                        -self.latent_sigma_mean, k=self.config['latent_analysis_dims'],
+                        name='latent_analysis_dims')
+                self.latent_analysis_mean = tf.gather(
+                        self.latent_mean, self.latent_analysis_dims, axis=1,
+                        name='latent_analysis_mean')
+
+        # optionally, run several training steps per run of the graph
+        if self.config['train_steps_per_run'] is not None:
+            n_steps = self.config['train_steps_per_run']
+            self.train_steps_loss = self.build_train_steps(n_steps)
+            # one call of run_update_and_loss now covers several mini-batches
+            # (rounded up, so that an epoch covers at least all batches)
+            self.num_batches = (self.num_batches + n_steps - 1) // n_steps
+        else:
+            self.train_steps_loss = None
+
+        # the values last assigned to the learning rate and beta variables
+        self.hyperparameter_values = dict()
+
+    def session_config(self):
+        if not self.config['use_mixed_precision']:
+            return None
+        # Compute the matmuls of the dense layers in float16 on GPUs with
+        # Tensor Cores (with float32 master weights). This only enables the
+        # rewrite for the session of this model, not process-wide.
+        config = tf.ConfigProto()
+        config.graph_options.rewrite_options.auto_mixed_precision = rewriter_config_pb2.RewriterConfig.ON
+        return config
+
+    def build_vae(self, input_tensor, bn_is_training):
+        """
+        Builds the VAE graph for INPUT_TENSOR, see build_vae_graph.
+        """
+        return build_vae_graph(
+                input_tensor=input_tensor,
+                bn_is_training=bn_is_training,
+                latent_layer_build_fun=self.config['build_vae_latent_layers_fun'],
+                **self.config)
+
+    def build_losses(self, targets, outputs, latent_mean, latent_sigma_sq, latent_log_sigma_sq):
+        """
+        Builds the reconstruction loss, the variational loss and the combined
+        loss (weighted by beta).
+        """
+
+        # reconstruction loss, already averaged over the samples (scalar)
+        with tf.variable_scope('reconstruction_losses'):
+            reconstruction_losses = self.config['reconstruction_loss'](targets, outputs)
+
+        # variational (KL) loss, already averaged over the samples (scalar)
+        with tf.variable_scope('variational_losses'):
+            variational_losses = self.config['variational_loss'](
+                    latent_mean, latent_sigma_sq, latent_log_sigma_sq)
+
+        # combined loss, scalar
+        with tf.variable_scope('loss'):
+            loss = reconstruction_losses + self.beta * variational_losses
+
+        return reconstruction_losses, variational_losses, loss
+
+    def build_train_steps(self, n_steps):
+        """
+        Builds a tf.while_loop that runs N_STEPS training steps in a single run
+        of the graph, each on a new mini-batch (see get_new_train_batch_op),
+        and returns the mean training loss of these steps. The steps share the
+        variables of the VAE graph and the optimizer, and batch norm is in
+        training mode.
+        """
+        if self.next_train_batch is None:
+            raise ValueError('train_steps_per_run requires the data to be provided by load_data.')
+
+        # Update ops that are created inside the loop can only be run from
+        # inside the loop. They are added as dependencies of the steps, and
+        # removed from the collection afterwards.
+        update_ops = self.graph.get_collection_ref(tf.GraphKeys.UPDATE_OPS)
+        n_update_ops = len(update_ops)
+
+        def train_step(step, loss_sum):
+            batch_inputs, batch_targets = self.get_new_train_batch_op()
+            batch_inputs = tf.cast(batch_inputs, tf.float32)
+            batch_targets = tf.cast(batch_targets, tf.float32)
+
+            with tf.variable_scope(self.vae_scope, reuse=True), maybe_xla_jit_scope(self.compile_graph):
+                outputs, \
+                _, \
+                latent_mean, \
+                _, \
+                latent_sigma_sq, \
+                latent_log_sigma_sq = self.build_vae(batch_inputs, True)
+
+            with tf.variable_scope('losses'), maybe_xla_jit_scope(self.config['use_xla_jit'] or self.compile_graph):
+                _, _, loss = self.build_losses(
+                        batch_targets, outputs, latent_mean,
+                        latent_sigma_sq, latent_log_sigma_sq)
+
+            with tf.control_dependencies(update_ops[n_update_ops:]), maybe_xla_jit_scope(self.compile_graph):
+                minimize_op = self.optimizer.minimize(loss)
+
+            with tf.control_dependencies([minimize_op]):
+                return step + 1, loss_sum + loss
+
+        _, loss_sum = tf.while_loop(
+                lambda step, loss_sum: step < n_steps, train_step,
+                loop_vars=(tf.constant(0), tf.constant(0.0)))
+
+        del update_ops[n_update_ops:]
+
+        return loss_sum / n_steps
+
+    def set_hyperparameters(self, learning_rate=None, beta=None, required=()):
+        """
+        Assigns LEARNING_RATE and BETA to their variables in the graph, if they
+        differ from the values that were assigned last. Values that are None
+        are left unchanged. Hence, the values are only passed to the graph
+        when they are changed, instead of feeding them in every step. Raises
+        a ValueError if a value named in REQUIRED is None and no value was
+        assigned (or restored) yet.
+        """
+        assign_ops = []
+        feed_dict = dict()
+        for name, value, assign_op, value_placeholder in [
+                ('learning_rate', learning_rate, self.assign_learning_rate_op, self.learning_rate_value),
+                ('beta', beta, self.assign_beta_op, self.beta_value)]:
+            if value is None and name in required and name not in self.hyperparameter_values:
+                raise ValueError('{:s} must be given (no value was assigned yet).'.format(name))
+            if value is not None and value != self.hyperparameter_values.get(name):
+                assign_ops.append(assign_op)
+                feed_dict[value_placeholder] = value
+                self.hyperparameter_values[name] = value
+        if len(assign_ops) > 0:
+            self.sess.run(assign_ops, feed_dict=feed_dict)
+
+    def run_update_and_loss(self, batch_inputs=None, batch_targets=None, learning_rate=None, beta=None):
+        self.set_hyperparameters(learning_rate=learning_rate, beta=beta, required=('learning_rate', 'beta'))
+        if batch_inputs is None and self.train_steps_loss is not None:
+            loss, _ = self.sess.run([self.train_steps_loss, self.increment_train_step_op])
+            return loss
+        feed_dict = {self.bn_is_training: True}
+        if batch_inputs is not None:
+            feed_dict[self.x_input] = batch_inputs
+            feed_dict[self.y_target] = batch_targets
+        loss, _ = self.sess.run([self.loss, self.minimize_op], feed_dict=feed_dict)
         return loss
 
-    def run_loss(self, batch_inputs, batch_targets, learning_rate, beta):
+    def run_loss(self, batch_inputs=None, batch_targets=None, learning_rate=None, beta=None):
+        self.set_hyperparameters(beta=beta, required=('beta',))
+        if batch_inputs is None:
+            # the validation batch comes from the validation input pipeline
+            return self.sess.run(self.validation_loss)
         loss = self.sess.run(self.loss, feed_dict={
                 self.x_input: batch_inputs,
                 self.y_target: batch_targets,
-                self.beta: beta,
                 self.bn_is_training: False})
         return loss
 
+    def infer_step(self, inds, inputs, *args, **kwargs):
+        """
+        With a static_batch_size, a smaller batch (e.g., the last chunk in
+        infer()) is padded with zeros to the static batch size, and only the
+        outputs for the actual samples are returned.
+        """
+        batch_inputs = inputs[inds]
+        static_batch_size = self.config['static_batch_size']
+        if static_batch_size is None or batch_inputs.shape[0] == static_batch_size:
+            return self.run_output(batch_inputs, *args, **kwargs)
+        if batch_inputs.shape[0] > static_batch_size:
+            raise ValueError('With static_batch_size, infer() needs a batch_size of at most static_batch_size.')
+        padded_inputs = np.zeros((static_batch_size,) + batch_inputs.shape[1:], dtype=batch_inputs.dtype)
+        padded_inputs[:batch_inputs.shape[0]] = batch_inputs
+        return self.run_output(padded_inputs, *args, **kwargs)[:batch_inputs.shape[0]]
+
+    def restore(self, save_path):
+        super(VAE, self).restore(save_path)
+        # the restored variables may hold other values than the ones that
+        # were assigned last
+        learning_rate, beta = self.sess.run([self.learning_rate, self.beta])
+        self.hyperparameter_values = {'learning_rate': learning_rate, 'beta': beta}
+
 if __name__ == '__main__':
 
     import numpy as np
     import matplotlib.pyplot as plt
     from mpl_toolkits import mplot3d
 
-    # create the model
-    conf = VAEConfig(
-            in_size=3,
-            latent_size=5,
-            encoder_size=[150,150],
-            hidden_activation=tf.nn.relu,
-            output_activation=None,
-            reconstruction_loss=tf.losses.mean_squared_error,
-            use_bn=True)
-    model = VAE(conf)
-
     # generate some data
     xx,yy = np.random.rand(2*10000).reshape((2,-1))
     z = lambda x, y: (np.sin(10*x) + np.cos(10*y)) * np.exp(-((x-0.5)**2+(y-0.5)**2)/0.1)
@@ -294,23 +590,41 @@ if __name__ == '__main__':
 
     x -= x.mean(axis=0)
     x /= x.std(axis=0)
+    x = x.astype(np.float32)
 
     x_train = x[:int(x.shape[0]*0.8)]
     x_valid = x[x_train.shape[0]:]
 
+    # provide the data through load_data, instead of feeding each mini-batch
+    # from Python (with on_device_data, the data is kept in device memory)
+    class DatasetVAE(VAE):
+        def load_data(self):
+            return x_train, x_train, x_valid, x_valid
+
+    # create the model
+    conf = VAEConfig(
+            in_size=3,
+            latent_size=5,
+            encoder_size=[150,150],
+            hidden_activation=tf.nn.relu,
+            output_activation=None,
+            reconstruction_loss=tf.losses.mean_squared_error,
+            use_bn=True,
+            batch_size=1000,
+            on_device_data=True,
+            train_steps_per_run=8,
+            latent_analysis_dims=3)
+    model = DatasetVAE(conf)
+
     # run the training
     for t in range(1000):
         model.train(
-                train_inputs=x_train,
-                train_targets=x_train,
-                validation_inputs=x_valid,
-                validation_targets=x_valid,
-                batch_size=1000,
                 learning_rate=0.01,
-                beta=0.01)
+                beta=0.01,
+                validation_every=50)
 
     # get estimates
-    reconstruction = np.vstack(model.infer(inputs=x_valid, batch_size=None))
+    reconstruction = model.infer(inputs=x_valid, batch_size=None)
 
     # plot data and estimates
     fig = plt.figure()
@@ -330,10 +644,10 @@ if __name__ == '__main__':
     zz = z(xx,yy)
     x = np.vstack((xx.flat,yy.flat,zz.flat)).T
 
-    latent_mean, latent_sigma = model.sess.run([model.latent_mean, model.latent_sigma], feed_dict={model.x_input: x, model.bn_is_training: False})
-    latent_sigma_mean = latent_sigma.mean(axis=0)
-    dim_inds = np.argsort(latent_sigma_mean)[:3]
-    latent_u,latent_v,latent_w = latent_mean[:,dim_inds].reshape((l.size,l.size,3)).transpose((2,0,1))
+    latent_mean, dim_inds, latent_sigma_mean = model.sess.run(
+            [model.latent_analysis_mean, model.latent_analysis_dims, model.latent_sigma_mean],
+            feed_dict={model.x_input: x, model.bn_is_training: False})
+    latent_u,latent_v,latent_w = latent_mean.reshape((l.size,l.size,3)).transpose((2,0,1))
 
     ax = fig.add_subplot(1,3,2,projection='3d')
     for ind in range(l.size):